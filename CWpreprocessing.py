@@ -11,193 +11,490 @@ started: 27/11/2025
 #################################################
 """
 
+import numpy as np
 import pandas as pd
 import sqlite3
 import re
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from functools import lru_cache
 from pathlib import Path
 
+# pyarrow is optional, the ADBC writer below needs it to turn the DFs into arrow tables
+# (CSVs are always parsed with the C engine, the arrow reader turns ISO date text into datetimes
+# and doesnt rename duplicate headers, both break the cleaning + saving)
+try:
+    import pyarrow as pa
+    HAS_PYARROW = True
+except ImportError:
+    HAS_PYARROW = False
+
+# the ADBC sqlite driver is optional too, it writes arrow tables straight into sqlite as whole columns
+try:
+    import adbc_driver_sqlite.dbapi as adbc_sqlite
+    HAS_ADBC = HAS_PYARROW
+except ImportError:
+    HAS_ADBC = False
+
+
+# Copy-on-Write means fillna/drop/set_axis etc only copy data when something is actually written
+# pandas 3 always has it on, on 2.x it has to be switched on (the option is deprecated in 3)
+if int(pd.__version__.split(".")[0]) < 3:
+    pd.set_option("mode.copy_on_write", True)
+
+# regex patterns used on every column, compiled once here instead of per call
+_RE_NONALNUM = re.compile(r"[^A-Za-z0-9]")
+_RE_Q = re.compile(r"^Q\s*(\d+)(?:\s*/\s*(\d+))?.*$", re.IGNORECASE)
+_RE_GRADE = re.compile(r"^Grades?\s*/\s*(\d+).*$", re.IGNORECASE)
+_RE_FALLBACK = re.compile(r"[ /?\-]")
+_RE_SCORE_COL = re.compile(r"^(Q\d+|Grades\d+|score)$")   # standardised score columns
+
+
+# header parsing lives outside the class so it can be cached, every CSV of the same test
+# (and every chunk of a chunked load) has the same header so it only gets parsed once
+@lru_cache(maxsize=128)
+def _classify_headers(headers: tuple[str, ...]) -> tuple[tuple[str, ...], tuple[tuple[str, int], ...]]:
+    if not headers:
+        return (), ()
+
+    # all headers go through the pandas string methods together instead of one at a time
+    cols = pd.Series(headers, dtype=object).str.strip()
+    compact = cols.str.replace(_RE_NONALNUM, "", regex=True).str.lower()
+    q = cols.str.extract(_RE_Q)        # Q columns like "Q 1 /500" -> number + max
+    g = cols.str.extract(_RE_GRADE)    # Grade columns like "Grade/10000" or "Grades/600" -> max
+
+    # redundant cols -> consistent names so drop works, these win over the Q/Grade patterns
+    is_state = compact.eq("state")
+    is_time = compact.isin(["timetaken", "timetakenminutes", "timetakenmins", "timetakenmin"])
+    is_q = q[0].notna() & ~is_state & ~is_time
+    is_g = g[0].notna() & ~is_q & ~is_state & ~is_time
+
+    # if everything else fails
+    names = cols.str.replace(_RE_FALLBACK, "", regex=True)
+    names[is_state] = "state"
+    names[is_time] = "timetaken"
+    names[is_q] = "Q" + q.loc[is_q, 0].astype(int).astype(str)
+    names[is_g] = "score"
+
+    denoms = pd.Series(None, index=cols.index, dtype=object)
+    denoms[is_q] = q.loc[is_q, 1]
+    denoms[is_g] = g.loc[is_g, 0]
+
+    # avoid collisions, 2nd copy of a name gets _2, 3rd gets _3 ...
+    dup = names.groupby(names, sort=False).cumcount()
+    names = names.where(dup == 0, names + "_" + (dup + 1).astype(str))
+
+    max_map = tuple((name, int(denom)) for name, denom in zip(names, denoms) if pd.notna(denom))
+    return tuple(names), max_map
+
 
 class CSVtoSQLite:
   
 
     clean_counter = 0
+    _shared_conn = None   # one connection reused by every converter that isnt given its own
 
-    def __init__(self, csv_path: str):
+    def __init__(self, csv_path: str, debug: bool = False, conn: sqlite3.Connection | None = None):
         self.csv_path = Path(csv_path)
+        self.conn = conn   # if None the shared class connection to CWDatabase.db is used
+        self.debug = debug  # when True the raw + cleaned snapshots are saved to the DB as well
         self.df = None
         self.current_prefix = None
         self.max_map = {}   # store true max from header
+        self._snapshots: dict[str, pd.DataFrame] = {}   # table suffix -> df, in pipeline order, for save_to_sqlite
 
 
     # load CSV
-    def load_csv(self) -> pd.DataFrame:
+    def load_csv(self, usecols: list[str] | None = None) -> pd.DataFrame:
         if not self.csv_path.exists():
             raise FileNotFoundError(f"{self.csv_path} not found")
 
-        self.df = pd.read_csv(self.csv_path)
+        # usecols lets the caller skip columns it doesnt need (e.g. only research id + Q columns)
+        # this stays on the C engine, the pyarrow one turns ISO date / time text into datetimes (pandas only applies
+        # dtype= after that so the original text cant be kept) and drops or keeps duplicate headers instead of
+        # renaming them Q 2, Q 2.1, both change the tables that get written
+        self.df = pd.read_csv(self.csv_path, usecols=usecols, engine="c", low_memory=False)
         self.current_prefix = self.csv_path.stem
         return self.df
 
 
-    # standardise column names + capture denoms from headers
-    def standardize_columns(self, df: pd.DataFrame) -> pd.DataFrame:
-        self.max_map = {}
-        new_cols = []
-        seen = {}
-
-        for col in df.columns:
-            raw = str(col).strip()
-            compact = re.sub(r"[^A-Za-z0-9]", "", raw).lower()
-
-            denom = None
+    # load CSV in chunks, each chunk gets the row level cleaning before the next one is read
+    def load_csv_chunks(self, chunksize: int = 50_000) -> pd.DataFrame:
+        if not self.csv_path.exists():
+            raise FileNotFoundError(f"{self.csv_path} not found")
 
-            # redundant cols -> consistent names so drop works
-            if compact == "state":
-                name = "state"
-            elif compact in {"timetaken", "timetakenminutes", "timetakenmins", "timetakenmin", "timetaken"}:
-                name = "timetaken"
+        partials = [self._clean_chunk(chunk) for chunk in self._read_chunks(chunksize)]
 
-            # Q columns like "Q 1 /500" -> Q1 and store 500
-            else:
-                m = re.match(r"^Q\s*(\d+)(?:\s*/\s*(\d+))?.*$", raw, flags=re.IGNORECASE)
-                if m:
-                    name = f"Q{int(m.group(1))}"
-                    denom = int(m.group(2)) if m.group(2) else None
-                else:
-                    # Grade columns like "Grade/10000" or "Grades/600" -> score and store max
-                    m = re.match(r"^Grades?\s*/\s*(\d+).*$", raw, flags=re.IGNORECASE)
-                    if m:
-                        name = "score"
-                        denom = int(m.group(1))
-                    else:
-                        # if everything else fails
-                        name = re.sub(r"[ /?\-]", "", raw.strip())
-
-            # avoid collisions
-            if name in seen:
-                seen[name] += 1
-                name = f"{name}_{seen[name]}"
-            else:
-                seen[name] = 1
+        self.current_prefix = self.csv_path.stem
+        return pd.concat(partials, ignore_index=True)
 
-            new_cols.append(name)
-            if denom is not None:
-                self.max_map[name] = denom
 
-        out = df.copy()
-        out.columns = new_cols
-        return out
+    def _read_chunks(self, chunksize: int, dtype: dict | None = None):
+        # C engine for the same reasons as load_csv (the arrow one has no chunksize either)
+        return pd.read_csv(self.csv_path, chunksize=chunksize, engine="c", dtype=dtype)
 
 
-    # normalize scores to 100
-    def normalize_scores(self, df: pd.DataFrame) -> pd.DataFrame:
-        score_cols = [
-            col for col in df.columns
-            if re.match(r"^Q\d+$", col)
-            or re.match(r"^Grades\d+$", col)
-            or col == "score"
-        ]
-        ## using the header max to normalise scores to 100 if it doesnt work we use the question max
-        for col in score_cols:
-            df[col] = pd.to_numeric(df[col], errors="coerce").fillna(0)
+    # standardise column names + capture denoms from headers
+    def standardize_columns(self, df: pd.DataFrame) -> pd.DataFrame:
+        new_cols, max_map = _classify_headers(tuple(str(col) for col in df.columns))
+        self.max_map = dict(max_map)
 
-            header_max = self.max_map.get(col)
+        # set_axis hands back a new frame with the renamed columns, no need to copy first
+        return df.set_axis(list(new_cols), axis=1)
 
-            if header_max and header_max > 0:
-                df[col] = (df[col] / header_max) * 100
-            else:
-                max = df[col].max()
-                if max > 0:
-                    df[col] = (df[col] / max) * 100
-                elif max > 100:
-                    df[col] = (df[col] / max) * 100
-        return df
 
-    # clean DF's
-    def clean_dataframe(self) -> pd.DataFrame:
+    # score columns after standardising: Q1, Q2 ..., Grades1 ... and score
+    @staticmethod
+    def score_columns(df: pd.DataFrame) -> list[str]:
+        return [col for col in df.columns if _RE_SCORE_COL.match(str(col))]
 
-        if self.df is None:
-            raise ValueError("Call load_csv() first")
+    # normalize scores to 100
+    def normalize_scores(self, df: pd.DataFrame, score_cols: list[str] | None = None,
+                         col_max: np.ndarray | None = None) -> pd.DataFrame:
+        # clean_dataframe already knows the score columns and passes them in
+        if score_cols is None:
+            score_cols = self.score_columns(df)
+        if not score_cols:
+            return df
 
-        CSVtoSQLite.clean_counter += 1
-        test_num = CSVtoSQLite.clean_counter
+        ## using the header max to normalise scores to 100 if it doesnt work we use the question max
+        # all score columns are scaled together as one 2D array instead of column by column
+        block = df[score_cols]
+        if all(dt == np.float64 for dt in block.dtypes):
+            # already float, read the block as it is (missing values still become 0)
+            mat = block.to_numpy(dtype=np.float64, na_value=0.0)
+        else:
+            mat = self._score_matrix(df, score_cols)
+
+        df[score_cols] = self._scale_scores(mat, score_cols, col_max)
+        return df
 
-        # keep original DF
-        setattr(self, f"dftest_{test_num}", self.df.copy())
+    # the normalising itself, on the plain float array of the score columns
+    def _scale_scores(self, mat: np.ndarray, score_cols: list[str], col_max: np.ndarray | None = None) -> np.ndarray:
+        header_max = np.array([self.max_map.get(col) or 0 for col in score_cols], dtype=np.float64)
+        # a streamed CSV passes in the column max of the whole file, not just this chunk
+        if col_max is None:
+            col_max = mat.max(axis=0, initial=0.0)
+        denoms = np.where(header_max > 0, header_max, col_max)
+
+        # columns with no positive max are left as they are
+        has_max = denoms > 0
+        return np.where(has_max, mat / np.where(has_max, denoms, 1.0) * 100, mat)
+
+    # the score columns as one float array, placeholders like "-" become 0
+    @staticmethod
+    def _score_matrix(df: pd.DataFrame, score_cols: list[str]) -> np.ndarray:
+        return df[score_cols].apply(pd.to_numeric, errors="coerce").fillna(0).to_numpy(dtype=np.float64)
+
+    # convert the score columns to numbers
+    @staticmethod
+    def _coerce_scores(df: pd.DataFrame, score_cols: list[str]) -> pd.DataFrame:
+        if score_cols:
+            df[score_cols] = CSVtoSQLite._score_matrix(df, score_cols)
+        return df
 
-        df = self.df.copy()
+    # row level cleaning, works the same on the whole DF or on one chunk of it
+    def _clean_chunk(self, df: pd.DataFrame) -> pd.DataFrame:
 
         #rename columns using the standardiser (handles Q1, score, state, timetaken)
         df = self.standardize_columns(df)
 
-        
-
         #  dropy empty rows
         df = df.dropna(how="all")
 
         # fill remaining missing values with 0
         df = df.fillna(0)
 
-        # drop redundant columns
-        for col in ["state", "timetaken"]:
-            if col in df.columns:
-                df = df.drop(columns=col)
+        # drop redundant columns (one drop call, missing ones are ignored)
+        df = df.drop(columns=["state", "timetaken"], errors="ignore")
+
+        return df
+
+    # clean DF's
+    def clean_dataframe(self, chunksize: int | None = None, test_num: int | None = None) -> pd.DataFrame:
+
+        if chunksize is None and self.df is None:
+            raise ValueError("Call load_csv() first")
+
+        # convert_many hands out its test numbers up front, everything else takes the next one
+        if test_num is None:
+            CSVtoSQLite.clean_counter += 1
+            test_num = CSVtoSQLite.clean_counter
+
+        if chunksize is None:
+            # keep original DF, every step below returns a new frame so self.df is never touched
+            if self.debug:
+                self._snapshots[f"dftest_{test_num}"] = self.df
+            df = self._clean_chunk(self.df)
+        else:
+            # chunked mode never holds the whole raw file so there is no dftest_ snapshot
+            df = self.load_csv_chunks(chunksize)
+
+        # the score columns are pulled out as one float array once, the dedup and normalise steps below
+        # work on that array and the frame only gets its score columns written back at the end
+        score_cols = self.score_columns(df)
+        mat = self._score_matrix(df, score_cols)
 
         # keep highest score per student
         if "research_id" in df.columns:
-            score_cols = [
-                c for c in df.columns
-                if c.startswith("Q") or c.startswith("Grades") or c == "score"
-            ]
-
-            if score_cols:
-                df["total_score"] = df[score_cols].sum(axis=1)
-                df = (
-                    df.sort_values("total_score", ascending=False)
-                      .drop_duplicates("research_id")
-                      .drop(columns="total_score")
-                )
+            # the total counts every Q.../Grades... column, suffixed duplicates like Q3_2 included,
+            # that is a wider set than the score columns that get normalised
+            total_cols = [c for c in df.columns if str(c).startswith(("Q", "Grades")) or c == "score"]
+
+            if total_cols:
+                total = mat if total_cols == score_cols else self._score_matrix(df, total_cols)
+                # idxmax over the row totals gives the position of the best row per student in one pass,
+                # sort=False so the ids dont get sorted either (students stay in the order they first appear in the CSV)
+                best = pd.Series(total.sum(axis=1)).groupby(df["research_id"].to_numpy(), sort=False).idxmax().to_numpy()
+                df = df.iloc[best]
+                mat = mat[best]
 
         # save cleaned df's
-        setattr(self, f"dfCleanTest_{test_num}", df.copy())
+        if self.debug:
+            clean = df.copy(deep=False)
+            if score_cols:
+                clean[score_cols] = mat
+            self._snapshots[f"dfCleanTest_{test_num}"] = clean
 
         # normalise scores to scale of 100
-        df = self.normalize_scores(df)
+        if score_cols:
+            df = df.copy(deep=False)
+            df[score_cols] = self._scale_scores(mat, score_cols)
 
         # rename formatted df's
-        setattr(self, f"dfFormattedCleanTest_{test_num}", df.copy())
+        self._snapshots[f"dfFormattedCleanTest_{test_num}"] = df
 
         self.df = df
         return df
 
 
-    # Save to SQLite
-    def save_to_sqlite(self) -> None:
+    @staticmethod
+    def _write_table(conn: sqlite3.Connection, table: str, df: pd.DataFrame, create: bool = True) -> None:
+        """drop + recreate the table and bulk insert the rows with executemany (same result as to_sql replace)
+        with create=False the rows are just appended to the existing table"""
+
+        def quote(name: str) -> str:
+            return '"' + str(name).replace('"', '""') + '"'
+
+        # same column types to_sql would pick for sqlite
+        col_defs = []
+        for col, dtype in zip(df.columns, df.dtypes):
+            if pd.api.types.is_bool_dtype(dtype) or pd.api.types.is_integer_dtype(dtype):
+                sql_type = "INTEGER"
+            elif pd.api.types.is_float_dtype(dtype):
+                sql_type = "REAL"
+            else:
+                sql_type = "TEXT"
+            col_defs.append(f"{quote(col)} {sql_type}")
+
+        if create:
+            conn.execute(f"DROP TABLE IF EXISTS {quote(table)}")
+            conn.execute(f"CREATE TABLE {quote(table)} ({', '.join(col_defs)})")
+
+        # iterating a numeric column already gives python scalars sqlite can bind, only columns that
+        # actually have missing values go through object dtype so their NaN can become NULL
+        columns = []
+        for i in range(df.shape[1]):
+            col = df.iloc[:, i]
+            if col.hasnans:
+                col = col.astype(object).where(col.notna(), None)
+            columns.append(col)
+        rows = zip(*columns)
+        placeholders = ", ".join("?" * len(df.columns))
+        conn.executemany(f"INSERT INTO {quote(table)} VALUES ({placeholders})", rows)
+
+
+    # connection helpers
+    @classmethod
+    def shared_connection(cls) -> sqlite3.Connection:
+        """open CWDatabase.db once and tune it, later converters just reuse it"""
+        if cls._shared_conn is None:
+            conn = sqlite3.connect("CWDatabase.db")
+            # WAL keeps readers (the analysis tabs) working while we write and needs fewer fsyncs
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA cache_size=-65536")   # 64MB page cache
+            conn.execute("PRAGMA temp_store=MEMORY")
+            cls._shared_conn = conn
+        return cls._shared_conn
+
+    @staticmethod
+    def read_connection(db_path: str) -> sqlite3.Connection:
+        """read only connection for the analysers, no write locks, the file mapped into memory and a 64MB page cache"""
+        conn = sqlite3.connect(db_path, check_same_thread=False)
+        conn.execute("PRAGMA query_only=ON")
+        conn.execute("PRAGMA mmap_size=268435456")   # 256MB
+        conn.execute("PRAGMA cache_size=-65536")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        return conn
+
+    @staticmethod
+    @contextmanager
+    def _transaction(conn: sqlite3.Connection):
+        """one transaction around the writes, when the caller already has one open they go in a savepoint
+        instead so a failed write only undoes its own tables and a good one doesnt commit the caller's work"""
+        if conn.in_transaction:
+            conn.execute("SAVEPOINT csv_to_sqlite")
+            try:
+                yield conn
+            except Exception:
+                conn.execute("ROLLBACK TO csv_to_sqlite")
+                conn.execute("RELEASE csv_to_sqlite")
+                raise
+            conn.execute("RELEASE csv_to_sqlite")
+            return
+
+        conn.execute("BEGIN")
+        try:
+            yield conn
+        except Exception:
+            conn.rollback()
+            raise
+        conn.commit()
 
-        conn = sqlite3.connect("CWDatabase.db")
+    @classmethod
+    def close_shared_connection(cls) -> None:
+        if cls._shared_conn is not None:
+            cls._shared_conn.close()
+            cls._shared_conn = None
+
+
+    def _save_with_adbc(self) -> bool:
+        """write every snapshot through ADBC in one transaction, returns False if a df cant become an arrow table"""
+        try:
+            tables = {
+                f"{self.current_prefix}_{name}": pa.Table.from_pandas(df, preserve_index=False)
+                for name, df in reversed(self._snapshots.items())
+            }
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            return False  # e.g. object column with mixed types, the executemany path handles those
+
+        conn = adbc_sqlite.connect("CWDatabase.db")
+        try:
+            # the ADBC connection is already in a transaction so everything lands in one commit
+            with conn.cursor() as cur:
+                for table_name, table in tables.items():
+                    cur.adbc_ingest(table_name, table, mode="replace")
+            conn.commit()
+        finally:
+            conn.close()
+        return True
 
-        prefixes = ("dftest_", "dfCleanTest_", "dfFormattedCleanTest_")
 
-        for attributes in dir(self):
+    # Save to SQLite
+    def save_to_sqlite(self) -> None:
 
-            if attributes.startswith(prefixes):
+        # ADBC only when we own the DB connection, a connection passed in by the caller is always used as is
+        if HAS_ADBC and self.conn is None and self._save_with_adbc():
+            return
 
-                df = getattr(self, attributes)
+        conn = self.conn if self.conn is not None else self.shared_connection()
 
-                if isinstance(df, pd.DataFrame):
+        # clean_dataframe only records the raw + cleaned snapshots when debug is on
+        # explicit transaction so the DROP/CREATEs are in the same one as the inserts
+        # (sqlite3 only opens one implicitly before INSERTs)
+        with self._transaction(conn):
+            # final formatted table first, its the smallest and the one the analysers read
+            for name, df in reversed(self._snapshots.items()):
+                self._write_table(conn, f"{self.current_prefix}_{name}", df)
 
-                    df.to_sql(
-                        f"{self.current_prefix}_{attributes}",
-                        conn,
-                        if_exists="replace",
-                        index=False
-                    )
 
-        conn.commit()
-        conn.close()
+    # stream a big CSV into sqlite chunk by chunk, only one chunk is ever in memory
+    def stream_to_sqlite(self, chunksize: int = 50_000) -> None:
+        if not self.csv_path.exists():
+            raise FileNotFoundError(f"{self.csv_path} not found")
 
+        header = pd.read_csv(self.csv_path, nrows=0)
+        new_cols, max_map = _classify_headers(tuple(str(col) for col in header.columns))
 
-    def convert(self) -> None:
+        # keeping the best attempt per student needs every row at once and debug wants the full snapshots,
+        # both go through the in memory path instead (still read in chunks)
+        if "research_id" in new_cols or self.debug:
+            self.clean_dataframe(chunksize)
+            self.save_to_sqlite()
+            return
+
+        CSVtoSQLite.clean_counter += 1
+        test_num = CSVtoSQLite.clean_counter
+        self.current_prefix = self.csv_path.stem
+        table = f"{self.current_prefix}_dfFormattedCleanTest_{test_num}"
+
+        score_cols = [col for col in new_cols if _RE_SCORE_COL.match(col)]
+        header_max = dict(max_map)
+
+        # each chunk infers its own dtypes, so a column that is empty in the first chunk would come out as
+        # 0.0 floats there and the table would be created REAL. one pass over the file first finds the dtype
+        # reading it whole would give (the common type over every chunk), the write pass then reads with those.
+        # score columns with no max in the header also need their column max over the whole file from it
+        need_max = any(not header_max.get(col) for col in score_cols)
+        col_max = np.zeros(len(score_cols)) if need_max else None
+        probe = None
+        for chunk in self._read_chunks(chunksize):
+            probe = chunk.iloc[:0] if probe is None else pd.concat([probe, chunk.iloc[:0]])
+            if need_max:
+                df = self._coerce_scores(self._clean_chunk(chunk), score_cols)
+                col_max = np.maximum(col_max, df[score_cols].to_numpy(dtype=np.float64).max(axis=0, initial=0.0))
+        ## keyed by position, duplicate headers get renamed by the parser
+        dtypes = None if probe is None else {
+            i: (dtype if pd.api.types.is_numeric_dtype(dtype) else str) for i, dtype in enumerate(probe.dtypes)
+        }
+
+        conn = self.conn if self.conn is not None else self.shared_connection()
+        with self._transaction(conn):
+            created = False
+            for chunk in self._read_chunks(chunksize, dtypes):
+                df = self._coerce_scores(self._clean_chunk(chunk), score_cols)
+                df = self.normalize_scores(df, score_cols, col_max)
+                self._write_table(conn, table, df, create=not created)
+                created = True
+
+            if not created:
+                # header only CSV, still create the (empty) table
+                self._write_table(conn, table, self._clean_chunk(header))
+
+
+    # pass a chunksize for big CSVs so the raw file is never fully loaded into memory
+    def convert(self, chunksize: int | None = None) -> None:
+        if chunksize is not None:
+            self.stream_to_sqlite(chunksize)
+            return
         self.load_csv()
         self.clean_dataframe()
         self.save_to_sqlite()
+
+
+    # convert a batch of CSVs, parsing + cleaning can run in worker processes while this one does the writing
+    @classmethod
+    def convert_many(cls, csv_paths: list[str], workers: int | None = 1, debug: bool = False,
+                     conn: sqlite3.Connection | None = None) -> None:
+        """
+        Same tables as calling convert() on each CSV in order, all written in one transaction.
+        workers > 1 (or None for one per CPU) parses the CSVs in a process pool, the module has to be importable
+        by name for that (the notebook loads it from a path, so it keeps the default of 1)
+        """
+        # test numbers are handed out here so the tables are numbered the same whichever process cleans them
+        jobs = [(str(path), debug, cls.clean_counter + i + 1) for i, path in enumerate(csv_paths)]
+        cls.clean_counter += len(jobs)
+
+        conn = conn if conn is not None else cls.shared_connection()
+        ex = ProcessPoolExecutor(max_workers=workers) if (workers is None or workers > 1) and len(jobs) > 1 else None
+        try:
+            results = ex.map(_parse_and_clean, jobs) if ex is not None else map(_parse_and_clean, jobs)
+
+            with cls._transaction(conn):
+                # results come back in CSV order, each one is written while the workers carry on with the rest
+                for prefix, snapshots in results:
+                    for name, df in reversed(snapshots.items()):
+                        cls._write_table(conn, f"{prefix}_{name}", df)
+        finally:
+            if ex is not None:
+                ex.shutdown(cancel_futures=True)
+
+
+# worker for convert_many, module level so the process pool can pickle it
+def _parse_and_clean(job: tuple[str, bool, int]) -> tuple[str, dict[str, pd.DataFrame]]:
+    csv_path, debug, test_num = job
+    conv = CSVtoSQLite(csv_path, debug=debug)
+    conv.load_csv()
+    conv.clean_dataframe(test_num=test_num)
+    return conv.current_prefix, conv._snapshots
@@ -1,7 +1,26 @@
-import sqlite3
 import re
+import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
+from CWpreprocessing import CSVtoSQLite
+
+# compiled once, question_columns runs these on every column of every table it gets
+_RE_QCOL = re.compile(r"Q\d+")
+_RE_DIGITS = re.compile(r"\d+")
+
+# The ID used in the CSV is researcher id, however to future proof this ive added other possibilities
+# (in order of preference)
+_ID_KEYS = (
+    "researchid", "researcherid", "researcher",
+    "studentid", "student",
+    "candidateid", "candidate",
+    "learnerid", "userid", "user",
+    "id"
+)
+# the alternatives are tried in order at the start of the name, so group n matching means key n is the
+# best key the column name contains (DOTALL so a quoted header with a newline in it still matches)
+_RE_ID = re.compile("^(?:" + "|".join(f"(?=.*({k}))" for k in _ID_KEYS) + ")", re.DOTALL)
+_RE_ID_NORM = re.compile(r"[ _-]")
 
 
 class StudentPerformance:
@@ -17,58 +36,92 @@ class StudentPerformance:
 
     def __init__(self, db_path: str):
         self.db_path = db_path
+        # one connection for the life of the analyser, the GUI calls analyse over and over on the same DB
+        self._conn = CSVtoSQLite.read_connection(self.db_path)
+        self._tables = None
+        self._table_cache: dict[str, pd.DataFrame] = {}
+        self._prepared_cache: dict[str, tuple[pd.DataFrame, list[str], pd.Series]] = {}
 
     ######################### DB helpers #################################
+    def refresh(self) -> None:
+        """forget the cached tables, call this after importing more CSVs into the DB"""
+        self._tables = None
+        self._table_cache.clear()
+        self._prepared_cache.clear()
+
+    def close(self) -> None:
+        self._conn.close()
+
     def list_tables(self) -> list[str]:
-        with sqlite3.connect(self.db_path) as conn:
-            tables = pd.read_sql(
-                "SELECT name FROM sqlite_master WHERE type='table' ORDER BY name",
-                conn
-            )["name"].tolist()
-        return tables
+        if self._tables is None:
+            # straight from the cursor, no DataFrame just to get one column of names
+            rows = self._conn.execute("SELECT name FROM sqlite_master WHERE type='table' ORDER BY name").fetchall()
+            self._tables = [r[0] for r in rows]
+        return list(self._tables)
 
     def load_table(self, table: str) -> pd.DataFrame:
-        with sqlite3.connect(self.db_path) as conn:
-            return pd.read_sql(f"SELECT * FROM '{table}'", conn)
+        # cached frames are shared, dont modify what this returns
+        if table not in self._table_cache:
+            # straight off the cursor into from_records, the same frame read_sql builds for a plain sqlite3 connection
+            cur = self._conn.execute(f"SELECT * FROM '{table}'")
+            self._table_cache[table] = pd.DataFrame.from_records(
+                cur.fetchall(), columns=[d[0] for d in cur.description], coerce_float=True
+            )
+        return self._table_cache[table]
 
-    # ######################### detection helpers #######################
-    def detect_student_id_col(self, df):
+    def _prepare_table(self, table: str) -> tuple[pd.DataFrame, list[str], pd.Series]:
+        """table indexed by student id (as str) with the question columns on 0-100, plus the class averages
+        built once per table, after that every student lookup is just a slice"""
+        if table not in self._prepared_cache:
+            raw = self.load_table(table)
+            sid_col = self.detect_student_id_col(raw)
 
-        """
-        Detect identifier column (student / researcher / candidate/ ect)
-        """
+            # index the table by student id once, then the lookup is a hash lookup instead of comparing every row
+            df = raw.set_index(raw[sid_col].astype(str))
 
+            # a table without question columns is still cached, analyse reports that only after the student lookup
+            try:
+                qcols = self.question_columns(df)
+            except ValueError:
+                qcols = []
 
-        def norm(s: str) -> str:
-            return str(s).lower().replace(" ", "").replace("_", "").replace("-", "")
+            # Convert question columns to comparable 0-100 numeric, the whole block at once
+            if qcols:
+                df[qcols] = self.ensure_numeric_0_100(df[qcols]).to_numpy()
 
-        cols = list(df.columns)
-        norm_cols = [norm(c) for c in cols]
+            averages = df[qcols].mean(numeric_only=True)
+            self._prepared_cache[table] = (df, qcols, averages)
+        return self._prepared_cache[table]
 
-       # The ID used in the CSV is researcher id, however to future proof this ive added other possibilities
-        keys = [
-            "researchid", "researcherid", "researcher",
-            "studentid", "student",
-            "candidateid", "candidate",
-            "learnerid", "userid", "user",
-            "id"
-        ]
+    # ######################### detection helpers #######################
+    def detect_student_id_col(self, df):
 
-        for k in keys:
-            for original, n in zip(cols, norm_cols):
-                if k in n:
-                    return original
+        """
+        Detect identifier column (student / researcher / candidate/ ect)
+        """
 
-        raise ValueError(
-            "Could not find an ID column."
-    )
+        # one match per column gives the best key it contains, the column with the best key wins
+        # (ties go to the leftmost column, same as checking the keys one by one)
+        best = None
+        for original in df.columns:
+            m = _RE_ID.match(_RE_ID_NORM.sub("", str(original).lower()))
+            if m and (best is None or m.lastindex < best[0]):
+                best = (m.lastindex, original)
+                if m.lastindex == 1:
+                    break
+
+        if best is None:
+            raise ValueError(
+                "Could not find an ID column."
+            )
+        return best[1]
 
 
     @staticmethod
     def question_columns(df: pd.DataFrame) -> list[str]:
         """  Identify question columns (Q1, Q2, etc.) in a DataFrame"""
-        qcols = [c for c in df.columns if re.fullmatch(r"Q\d+", str(c))]
-        qcols.sort(key=lambda x: int(re.findall(r"\d+", x)[0]))
+        qcols = [c for c in df.columns if _RE_QCOL.fullmatch(str(c))]
+        qcols.sort(key=lambda x: int(_RE_DIGITS.search(x).group()))
         if not qcols:
             raise ValueError("No question columns found (expected columns like Q1, Q2, ...).")
         return qcols
@@ -76,19 +129,28 @@ class StudentPerformance:
     """the reason for normalizing again after the Preprocessing is due to you being able to select every table in the database
     some tables havent gont through the normalization so this ensures that all tables are normalized before analysis"""
     @staticmethod
-    def ensure_numeric_0_100(series: pd.Series) -> pd.Series:
-        s = pd.to_numeric(series, errors="coerce").fillna(0)
-
-        # If values look like 0-1 proportions, scale
-        if s.max() <= 1.0:
-            s = s * 100
+    def ensure_numeric_0_100(data: pd.Series | pd.DataFrame) -> pd.Series | pd.DataFrame:
+        # works on one column or a whole block of them, each column gets its own scaling
+        # missing / non numeric values become 0 while converting to the float array, no separate fillna pass
+        if isinstance(data, pd.Series):
+            arr = pd.to_numeric(data, errors="coerce").to_numpy(dtype=np.float64, na_value=0.0)
+            return pd.Series(StudentPerformance.scale_block_0_100(arr), index=data.index, name=data.name)
 
-        # If values exceed 100, normalise down to 100
-        if s.max() > 100:
-            mx = s.max()
-            s = (s / mx) * 100 if mx > 0 else 0
+        block = data.apply(pd.to_numeric, errors="coerce").to_numpy(dtype=np.float64, na_value=0.0)
+        return pd.DataFrame(StudentPerformance.scale_block_0_100(block), index=data.index, columns=data.columns)
 
-        return s
+    @staticmethod
+    def scale_block_0_100(block: np.ndarray) -> np.ndarray:
+        """ensure_numeric_0_100 for every column of a 2D array (or a single 1D column): one pass for the column max,
+        then one multiply by a per-column factor (x100 for 0-1 proportions, 100/max above 100)"""
+        if block.size == 0:
+            return block
+        mx = np.asarray(block.max(axis=0))
+        factor = np.ones_like(mx)
+        factor[mx <= 1.0] = 100.0
+        over = mx > 100
+        factor[over] = 100.0 / mx[over]
+        return block * factor
 
     @staticmethod
     def pick_default_test_table(tables: list[str]) -> str | None:
@@ -110,19 +172,13 @@ class StudentPerformance:
         if table not in tables:
             raise ValueError(f"Table '{table}' not found.")
 
-        df = self.load_table(table)
-        sid_col = self.detect_student_id_col(df)
-
-        df_student = df[df[sid_col].astype(str) == str(student_id)].copy()
-        if df_student.empty:
+        df, qcols, averages = self._prepare_table(table)
+        if str(student_id) not in df.index:
             raise ValueError(f"No row found for student_id={student_id} in '{table}'.")
+        if not qcols:
+            self.question_columns(df)   # raises the no question columns error
 
-        qcols = self.question_columns(df)
-
-        # Convert question columns to comparable 0-100 numeric
-        for c in qcols:
-            df[c] = self.ensure_numeric_0_100(df[c])
-            df_student[c] = self.ensure_numeric_0_100(df_student[c])
+        df_student = df.loc[[str(student_id)]].copy()
 
         # If multiple attempts exist, keep best attempt by total across questions
         if len(df_student) > 1:
@@ -134,7 +190,6 @@ class StudentPerformance:
             )
 
         student_row = df_student.iloc[0]
-        averages = df[qcols].mean(numeric_only=True)
         student_scores = student_row[qcols].astype(float)
 
         absolute = student_scores
@@ -1,9 +1,19 @@
 
 
-import sqlite3
+import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
-plt.show()
+from CWpreprocessing import CSVtoSQLite
+
+# substrings that mark a column as the ID column
+_ID_KEYS = ("researchid", "researcherid", "studentid", "student", "candidateid", "candidate", "userid", "user", "id")
+
+_UNION_BATCH = 200   # tables per UNION ALL query
+
+
+def _quote(name: str) -> str:
+    """quote a table/column name for SQL, so names with quotes or brackets in them still work"""
+    return '"' + str(name).replace('"', '""') + '"'
 
 
 class TestResultsAnalyzer:
@@ -27,48 +37,83 @@ class TestResultsAnalyzer:
         except ValueError:
             pass  # keep as text fallback
 
-        conn = sqlite3.connect(db_path)
-
-        tables = pd.read_sql(
-            "SELECT name FROM sqlite_master WHERE type='table' ORDER BY name;",
-            conn
-        )["name"].tolist()
+        conn = CSVtoSQLite.read_connection(db_path)
+
+        # every table's columns in one query instead of a PRAGMA per table
+        schema_rows = conn.execute(
+            "SELECT m.name, p.name, p.type FROM sqlite_master AS m JOIN pragma_table_info(m.name) AS p "
+            "WHERE m.type='table' ORDER BY m.name, p.cid;"
+        ).fetchall()
+        schemas: dict[str, list[str]] = {}
+        col_types: dict[tuple[str, str], str] = {}
+        for table, col, col_type in schema_rows:
+            schemas.setdefault(table, []).append(col)
+            col_types[table, col] = (col_type or "").upper()
+
+        # tables with the same columns (and so the same ID column) get queried together with UNION ALL
+        groups: dict[tuple[str, ...], list[str]] = {}
+        for table, cols in schemas.items():
+            # Detect the ID column (first column containing one of the keys)
+            id_col = next((c for c, low in zip(cols, map(str.lower, cols)) if any(k in low for k in _ID_KEYS)), None)
+            if id_col is None:
+                continue
+            groups.setdefault(tuple(cols), []).append((table, id_col))
 
+        # Query only matching rows directly in SQL
+        if sid_int is not None:
+            params = {"sid": sid_int}
+        else:
+            params = {"sid": sid_raw}
+
+        def where(table: str, id_col: str) -> str:
+            if sid_int is None:
+                # Fallback for non-numeric IDs
+                return f"TRIM(CAST({_quote(id_col)} AS TEXT)) = :sid"
+            if "INT" in col_types[table, id_col]:
+                # INTEGER column, the values stored as ints are compared directly instead of casting every row,
+                # anything else it holds (e.g. a REAL like 12.5 or text) still goes through the CAST
+                col = _quote(id_col)
+                return f"({col} = :sid OR (typeof({col}) NOT IN ('integer', 'null') AND CAST({col} AS INTEGER) = :sid))"
+            return f"CAST({_quote(id_col)} AS INTEGER) = :sid"
+
+        # source_table is stored as a categorical over all table names, one small int per row instead of a string
+        # (the categories are in name order so sorting on it keeps the table order)
+        table_names = list(schemas)
         student_data = []
 
-        for table in tables:
-            try:
-                # Read column names first
-                cols = pd.read_sql(f"PRAGMA table_info([{table}]);", conn)["name"].tolist()
-
-                # Detect the ID column
-                id_cols = [c for c in cols if any(k in c.lower() for k in ["researchid","researcherid","studentid","student","candidateid","candidate","userid","user","id"])]
-                if not id_cols:
-                    continue
-                id_col = id_cols[0]
-
-                # Query only matching rows directly in SQL
-                if sid_int is not None:
-                    q = f"SELECT *, '{table}' AS source_table FROM [{table}] WHERE CAST([{id_col}] AS INTEGER) = ?"
-                    df_student = pd.read_sql_query(q, conn, params=(sid_int,))
-                else:
-                    # Fallback for non-numeric IDs
-                    q = f"SELECT *, '{table}' AS source_table FROM [{table}] WHERE TRIM(CAST([{id_col}] AS TEXT)) = ?"
-                    df_student = pd.read_sql_query(q, conn, params=(sid_raw,))
-
-                if not df_student.empty:
-                    student_data.append(df_student)
-
-            except Exception:
-                continue
-
-        conn.close()
+        # tables without an ID column were already skipped using the schema, so every query here is valid
+        # and any error is a real one (no try/except around each table)
+        try:
+            for members in groups.values():
+                # sqlite allows at most 500 SELECTs in one compound query, so very big groups are split up
+                for start in range(0, len(members), _UNION_BATCH):
+                    batch = members[start:start + _UNION_BATCH]
+                    # the table names go in as parameters so a name with a quote in it cant break the query
+                    q = " UNION ALL ".join(
+                        f"SELECT *, :t{i} AS source_table FROM {_quote(table)} WHERE " + where(table, id_col)
+                        for i, (table, id_col) in enumerate(batch)
+                    )
+                    cur = conn.execute(q, {**params, **{f"t{i}": table for i, (table, _) in enumerate(batch)}})
+
+                    # build the df straight from the cursor rows, skips the read_sql wrapper
+                    rows = cur.fetchall()
+                    if rows:
+                        part = pd.DataFrame.from_records(rows, columns=[d[0] for d in cur.description])
+                        part["source_table"] = pd.Categorical(part["source_table"], categories=table_names)
+                        student_data.append(part)
+        finally:
+            conn.close()
 
         if not student_data:
             print(f"No data found for researcher ID: {student_id}")
             return None
 
-        return pd.concat(student_data, ignore_index=True)
+        # groups come out in order of their first table, the stable sort puts the rows back in table name order
+        # (ignore_index renumbers the rows in the sort itself instead of a reset_index copy afterwards)
+        return (
+            pd.concat(student_data, ignore_index=True, sort=False)
+              .sort_values("source_table", kind="stable", ignore_index=True)
+        )
 
     @staticmethod
     
@@ -82,8 +127,6 @@ class TestResultsAnalyzer:
             print("No data to plot.")
             return
 
-        df = df.copy()
-
         # Picks a score column
         
         if "score" not in df.columns:
@@ -92,32 +135,29 @@ class TestResultsAnalyzer:
             if not score_candidates:
                 raise ValueError("No score/grade column found to plot (expected columns like 'Grade...' or 'Grades').")
             score_col = score_candidates[0]
-            df["score"] = df[score_col]
         else:
             score_col = "score"
 
-        # Convert to numeric
-        df["score"] = pd.to_numeric(df["score"], errors="coerce")
+        # Convert to numeric, only the score column is touched so the caller's df isnt copied
+        score = pd.to_numeric(df[score_col], errors="coerce")
+        has_score = score.notna()
 
-        # one score per table
+        # one score per table, the labels and heights go to matplotlib as plain arrays
         if "source_table" in df.columns:
-            plot_df = (
-                df.dropna(subset=["score"])
-                .groupby("source_table", as_index=False)["score"]
-                .max()  # keep highest score per table
-                .rename(columns={"source_table": "Assessment"})
-            )
+            per_table = score[has_score].groupby(df["source_table"][has_score], observed=True).max()  # keep highest score per table
+            labels = per_table.index.astype(str).to_numpy()
+            heights = per_table.to_numpy(dtype=np.float64)
         else:
-            plot_df = df.dropna(subset=["score"]).copy()
-            plot_df["Assessment"] = "Assessment"
+            heights = score[has_score].to_numpy(dtype=np.float64)
+            labels = np.full(len(heights), "Assessment")
 
-        if plot_df.empty:
+        if len(heights) == 0:
             print("No numeric scores available to plot.")
             return
 
         # Plot
         plt.figure(figsize=(10, 4))
-        plt.bar(plot_df["Assessment"].astype(str), plot_df["score"].astype(float))
+        plt.bar(labels, heights)
         plt.xticks(rotation=45, ha="right")
         plt.ylabel("Score")
         plt.title(f"Scores for Researcher ID: {student_id}")
@@ -1,8 +1,67 @@
 # underperformingStudent.py
-import sqlite3
 import re
+from collections.abc import Callable
+from functools import lru_cache
+import numpy as np
 import pandas as pd
+import matplotlib
 import matplotlib.pyplot as plt
+from CWpreprocessing import CSVtoSQLite
+
+# compiled once, these run on every column / table name of every report
+_RE_QCOL = re.compile(r"Q\d+")
+_RE_TRAILING_NUM = re.compile(r"_dfFormattedCleanTest_(\d+)$")
+_RE_NORM = re.compile(r"[^a-z0-9]")
+
+# The ID used in the CSV is researcher id, however to future proof this ive added other possibilities
+_ID_KEYWORDS = ("studentid", "student", "researchid", "research", "candidateid", "candidate", "id")
+# the first column containing any keyword wins, so one alternation checks them all at once
+_RE_ID_KEYWORD = re.compile("|".join(_ID_KEYWORDS))
+
+_FORMATIVE_CHUNK = 200_000   # rows per read when reducing a formative table
+
+
+# the column detectors only look at the column names, so they are cached on the names
+# (every formatted table has the same columns, so the report works them out once)
+@lru_cache(maxsize=64)
+def _detect_id_col(cols: tuple) -> str | None:
+    for col in cols:
+        if _RE_ID_KEYWORD.search(_RE_NORM.sub("", str(col).lower())):
+            return col
+    return None
+
+
+def _sid_strings(ids: pd.Series) -> pd.Series:
+    """student ids as strings, an int id column that came back as float (e.g. a NULL in it) still prints as 40 not 40.0,
+    so the same student gets the same key whichever table (or chunk of a table) it came from"""
+    if pd.api.types.is_float_dtype(ids):
+        arr = ids.to_numpy(dtype=np.float64)
+        present = ~np.isnan(arr)
+        if np.isfinite(arr[present]).all() and (arr[present] == np.trunc(arr[present])).all():
+            return ids.astype("Int64").astype(str).where(ids.notna(), "nan")
+    return ids.astype(str)
+
+
+def _score_column_total(df: pd.DataFrame) -> pd.Series:
+    return pd.to_numeric(df["score"], errors="coerce").fillna(0)
+
+
+def _qcol_total(df: pd.DataFrame, qcols: list[str]) -> pd.Series:
+    # one float array for all the Q columns and a numpy row sum, missing values count as 0
+    qdf = df[qcols]
+    if not all(pd.api.types.is_numeric_dtype(dt) for dt in qdf.dtypes):
+        qdf = qdf.apply(pd.to_numeric, errors="coerce")
+    return pd.Series(qdf.to_numpy(dtype=np.float64, na_value=0.0).sum(axis=1), index=df.index)
+
+
+def _trailing_num(name: str) -> int:
+    m = _RE_TRAILING_NUM.search(name) ## uses the number at the end of the name and uses the most recent or biggest
+    return int(m.group(1)) if m else -1
+
+
+@lru_cache(maxsize=64)
+def _qcols(cols: tuple) -> tuple:
+    return tuple(c for c in cols if _RE_QCOL.fullmatch(str(c)))
 
 
 class UnderperformingStudents:
@@ -17,20 +76,39 @@ class UnderperformingStudents:
 
     def __init__(self, db_path: str):
         self.db_path = db_path
+        # one read only connection for every query the report makes instead of a new one per table
+        self._conn = CSVtoSQLite.read_connection(self.db_path)
+        self._tables = None
+        self._table_cache: dict[str, pd.DataFrame] = {}
+        self._total_score_cache: dict[str, pd.Series] = {}
+        self._summative_candidates: dict[tuple, list[str]] = {}
+        self._scorer_cache: dict[tuple, Callable[[pd.DataFrame], pd.Series] | None] = {}
 
     ############# DB helpers ###################
+    def refresh(self) -> None:
+        """forget everything cached from the DB, call after importing more CSVs"""
+        self._tables = None
+        self._table_cache.clear()
+        self._total_score_cache.clear()
+        self._summative_candidates.clear()
+
     def list_tables(self) -> list[str]:
-        """"List all tables in the SQLite database"""
-        with sqlite3.connect(self.db_path) as conn:
-            tables = pd.read_sql("SELECT name FROM sqlite_master WHERE type='table'", conn)
+        """"List all tables in the SQLite database (read once, see refresh)"""
+        if self._tables is None:
+            # straight from the cursor, no DataFrame just to get one column of names
+            rows = self._conn.execute("SELECT name FROM sqlite_master WHERE type='table'").fetchall()
+            self._tables = [r[0] for r in rows]
 
-        return tables["name"].tolist()
+        return list(self._tables)
 
     def load_table(self, table: str) -> pd.DataFrame:
-        """Load the DB table into pandas"""
-        with sqlite3.connect(self.db_path) as conn:
+        """Load the DB table into pandas, each table is only read once (dont modify the returned df)"""
+        if table not in self._table_cache:
+            self._table_cache[table] = pd.read_sql(f"SELECT * FROM '{table}'", self._conn) #loads the specified table from the database into a pandas DataFrame
+        return self._table_cache[table]
 
-            return pd.read_sql(f"SELECT * FROM '{table}'", conn) #loads the specified table from the database into a pandas DataFrame
+    def close(self) -> None:
+        self._conn.close()
 
     ##################### detection helpers ##################
     """
@@ -40,19 +118,10 @@ class UnderperformingStudents:
         """
         Detect identifier column (student / researcher / candidate).
         """
-        cols = list(df.columns)
-        
-
-        # The ID used in the CSV is researcher id, however to future proof this ive added other possibilities
-        id_keywords = ["studentid", "student","researchid", "research","candidateid", "candidate","id"]
-
-        for col in df.columns:
-            cleaned = re.sub(r"[^a-z0-9]", "", str(col).lower())
-            for key in id_keywords: ## insertion sort method of checking if any of the keywords are in the cleaned column name
-                if key in cleaned:
-                    return col
-
-        raise ValueError(f"No ID found. Columns were: {cols}")
+        id_col = _detect_id_col(tuple(df.columns))
+        if id_col is None:
+            raise ValueError(f"No ID found. Columns were: {list(df.columns)}")
+        return id_col
 
 
     @staticmethod
@@ -67,28 +136,63 @@ class UnderperformingStudents:
         if not candidates:
             return tables[0] if tables else None## if no formatted tables exist return the first table and if none exist return nothing
 
-        def end_num(name: str) -> int:
-
-            m = re.search(r"_dfFormattedCleanTest_(\d+)$", name) ## uses the number at the end of the name and uses the most recent or biggest
-            return int(m.group(1)) if m else -1
-
-        candidates.sort(key=end_num, reverse=True)
-        return candidates[0]##picks the most recent formatted table
-
-    def get_total_score(self, df: pd.DataFrame) -> pd.Series:
-    # Prefer explicit score column
-        if "score" in df.columns:
-            s = pd.to_numeric(df["score"], errors="coerce").fillna(0)
-            return s
-
-        # Otherwise sum Q columns
-        qcols = [c for c in df.columns if re.fullmatch(r"Q\d+", str(c))]
-        if qcols:
-            qdf = df[qcols].apply(pd.to_numeric, errors="coerce").fillna(0)
-            return qdf.sum(axis=1)
+        # the sorted candidates are kept, building reports for other thresholds reuses them
+        key = tuple(candidates)
+        if key not in self._summative_candidates:
+            self._summative_candidates[key] = sorted(candidates, key=_trailing_num, reverse=True)
+        return self._summative_candidates[key][0]##picks the most recent formatted table
+
+    def get_total_score(self, df: pd.DataFrame, table: str | None = None) -> pd.Series:
+        # pass the table name to keep the totals, the cached tables never change so neither do their totals
+        if table is not None:
+            if table not in self._total_score_cache:
+                self._total_score_cache[table] = self.get_total_score(df)
+            return self._total_score_cache[table]
+
+        scorer = self._scorer(tuple(df.columns))
+        return scorer(df) if scorer is not None else None
+
+    def _scorer(self, cols: tuple) -> Callable[[pd.DataFrame], pd.Series] | None:
+        """the total score function for tables with these columns, worked out once per schema
+        (every formatted table in a DB has the same columns, so the score/Q column checks only run once)"""
+        if cols not in self._scorer_cache:
+            # Prefer explicit score column, otherwise sum Q columns
+            if "score" in cols:
+                scorer = _score_column_total
+            else:
+                qcols = list(_qcols(cols))
+                scorer = (lambda d, q=qcols: _qcol_total(d, q)) if qcols else None
+            self._scorer_cache[cols] = scorer
+        return self._scorer_cache[cols]
+
+    def _best_formative_totals(self, table: str) -> pd.Series:
+        """each student's best total in one formative table, indexed by student id (as str)
+        the table is read in chunks and reduced as it goes so a big table is never fully in memory"""
+        if table in self._table_cache:
+            chunks = [self._table_cache[table]]
+        else:
+            chunks = pd.read_sql(f"SELECT * FROM '{table}'", self._conn, chunksize=_FORMATIVE_CHUNK)
+
+        partials = []
+        id_for = None
+        for chunk in chunks:
+            if id_for is None:
+                id_for = self.detect_id_col(chunk)#detect id column, once per table (every chunk has the same columns)
+            total = self.get_total_score(chunk)#get total score for each student using the function
+            if total is None:
+                # no score or Q columns (e.g. a survey table), theres nothing to compare so the table is skipped
+                return pd.Series(dtype=np.float64)
+            #keep highest score per student, per chunk and then across the chunks
+            partials.append(pd.Series(total.to_numpy(dtype=np.float64), index=_sid_strings(chunk[id_for]).to_numpy())
+                              .groupby(level=0, sort=False).max())
+
+        return pd.concat(partials).groupby(level=0, sort=False).max()
 
     ######################### main API #################################### 
-    def build_report(self,summative_table: str | None = None,threshold: float = 40.0) -> tuple[pd.DataFrame, str]:
+    def build_report(self,summative_table: str | None = None,threshold: float = 40.0,
+                     only_underperforming: bool = False) -> tuple[pd.DataFrame, str]:
+        """only_underperforming=True leaves out students at or above the threshold before the formative lookup,
+        for callers like plot_underperformers that only need those rows"""
         
         tables = self.list_tables()#gets all the tables 
         tests = self.formatted_test_tables(tables)#gets the formatted ones only
@@ -100,81 +204,106 @@ class UnderperformingStudents:
         df_sum = self.load_table(summative_table)
         id_col = self.detect_id_col(df_sum)
 
-        df_sum["total"] = self.get_total_score(df_sum)
+        df_sum = df_sum.assign(total=self.get_total_score(df_sum, summative_table))# assign so the cached table isnt changed
+
+        # best attempt per student, idxmax finds each student's top row without sorting the whole table
+        df_sum_best = df_sum.loc[df_sum.groupby(id_col, sort=False, dropna=False)["total"].idxmax()]
+        if only_underperforming:
+            df_sum_best = df_sum_best[df_sum_best["total"].to_numpy(dtype=np.float64) < threshold]
 
-        df_sum_best = (
-            df_sum.sort_values("total", ascending=False)
-                .drop_duplicates(subset=[id_col], keep="first")
-        )
         #compute each student's lowest formative score
         formative_tables = [t for t in tests if t != summative_table] ##removes the summative table from the formative tables list
-        formative_min: dict[str, tuple[float, str]] = {}## this stores the score as a str and the score as a float and the table name as a str
-
+        if df_sum_best.empty:
+            formative_tables = []# nobody to report on, no need to read the formative tables
+        # lowest formative score + table per student id (as str), empty if there are no formative tables
+        formative_min = pd.DataFrame({"lowest_formative_score": pd.Series(dtype=np.float64),
+                                      "lowest_formative_table": pd.Series(dtype=object)},
+                                     index=pd.Index([], dtype=object))
+
+        # one small (id, best total, table) frame per formative table, then the table with each students lowest
+        frames = []
         for t in formative_tables:
-            df_for = self.load_table(t)#load table in df
-            id_for = self.detect_id_col(df_for)#detect id column
-
-            df_for["total"] = self.get_total_score(df_for)#get total score for each student using the function
-
-            #keep highest score per student
-            df_for_best = (
-                df_for.sort_values("total", ascending=False)
-                    .drop_duplicates(subset=[id_for], keep="first")
-            )
-
-            for _, row in df_for_best.iterrows():
-                id = str(row[id_for])# convert id to string
-                stud_score = float(pd.to_numeric(row["total"], errors="coerce") or 0)# get student score as int
-
-                if id not in formative_min or stud_score < formative_min[id][0]:#if id isnt in the dict store it OR if currentscore is lower replace
-                    formative_min[id] = (stud_score, t)
-
-        """now we are looping through each students best sum score and lowest best form score to build the report"""
-        rows = [] # becomes the df
-        for _, r in df_sum_best.iterrows():# loop through each students best summative score
-            id = str(r[id_col])#this is the ID
-            sum_score = float(r["total"])# total sum score
-            formin_score, formin_table = formative_min.get(id, (None, "N/A"))# get lowest form score and store N/A if none exist
-
-            rows.append({"student_id": id, "summative_table": summative_table, "summative_score": sum_score,
-                         "lowest_formative_score": formin_score,"lowest_formative_table": formin_table,"is_underperforming": sum_score < threshold})
-            
-        ##makes the dicts a df, sorts from lowest sum to highest and makes index 0 to n-1
-        report = pd.DataFrame(rows).sort_values("summative_score", ascending=True).reset_index(drop=True)
+            best = self._best_formative_totals(t)
+            if best.empty:
+                continue
+            frames.append(pd.DataFrame({"_sid": best.index, "_total": best.to_numpy(), "_table": t}))
+
+        if frames:
+            # a student with no numeric total in a table cant have their lowest score there
+            all_for = pd.concat(frames, ignore_index=True).dropna(subset=["_total"])
+            # idxmin takes the first on a tie so the earlier table wins
+            lowest = all_for.loc[all_for.groupby("_sid", sort=False)["_total"].idxmin()]
+            formative_min = pd.DataFrame({"lowest_formative_score": lowest["_total"].to_numpy(dtype=np.float64),
+                                          "lowest_formative_table": lowest["_table"].to_numpy()},
+                                         index=lowest["_sid"].to_numpy())
+
+        """the report is built a column at a time from each students best sum score, then joined to the lowest formative scores"""
+        report = pd.DataFrame({
+            "student_id": _sid_strings(df_sum_best[id_col]).to_numpy(),#this is the ID
+            "summative_table": summative_table,
+            "summative_score": df_sum_best["total"].to_numpy(dtype=np.float64),# total sum score
+        })
+        report = report.join(formative_min, on="student_id")
+        report["lowest_formative_table"] = report["lowest_formative_table"].fillna("N/A")# store N/A if no formative score exists
+        report["is_underperforming"] = report["summative_score"] < threshold
+
+        ## sorts from lowest sum to highest and makes index 0 to n-1
+        # stable sort so students with the same score stay in the order they appear in the summative table
+        report = report.sort_values("summative_score", ascending=True, kind="stable", ignore_index=True)
         return report, summative_table
     
 
 #################### BUILDING THE REPORT #######################
-    def plot_underperformers(self, report: pd.DataFrame, summative_table: str, threshold: int) -> None:
+    def plot_underperformers(self, report: pd.DataFrame, summative_table: str, threshold: int,
+                             ax=None, show: bool = True):
+        """
+        ax: optional pair of matplotlib axes to draw into (nothing is shown or closed then)
+        show: set False to just get the figure back, e.g. to save it when running without a display
+        """
 
-        under = report[report["is_underperforming"]].copy()#filter only underperforming students
+        under = report[report["is_underperforming"]]#filter only underperforming students (only read, so no copy)
         
         if under.empty:
             print("No underperforming students found for this threshold.")
-            return
+            return None
 
         """ 
-        plot 2 bar charts:
+        plot 2 bar charts side by side in one figure:
          - bar chart 1 - summative of underperforming students, x axis student id, y axis summative score
          - bar chart 2 - summative vs lowest formative, bar for summative, scatter for formative
         """
 
-        plt.figure(figsize=(12, 6))
-        plt.bar(under["student_id"], under["summative_score"])
-        plt.title(f"Underperforming Students (Summative: {summative_table}, Threshold < {threshold})")
-        plt.xlabel("Student ID")
-        plt.ylabel("Summative Score (%)")
-        plt.xticks(rotation=60, ha="right")
-        plt.tight_layout()
-        plt.show()
-
-        plt.figure(figsize=(12, 6))
-        plt.bar(under["student_id"], under["summative_score"], label="Summative (%)")
-        plt.scatter(under["student_id"], under["lowest_formative_score"], label="Lowest Formative (%)")
-        plt.title("Summative vs Lowest Formative (Underperforming Students)")
-        plt.xlabel("Student ID")
-        plt.ylabel("Score (%)")
-        plt.xticks(rotation=60, ha="right")
-        plt.legend()
-        plt.tight_layout()
-        plt.show()
+        # pulled out as arrays once and shared by both charts, the report is already sorted by summative score
+        sid = under["student_id"].to_numpy(dtype=str)
+        sum_scores = under["summative_score"].to_numpy(dtype=np.float64)
+        for_scores = under["lowest_formative_score"].to_numpy(dtype=np.float64)
+
+        if ax is None:
+            fig, (ax1, ax2) = plt.subplots(1, 2, figsize=(18, 6))
+        else:
+            ax1, ax2 = ax
+            fig = ax1.figure
+
+        ax1.bar(sid, sum_scores)
+        ax1.set_title(f"Underperforming Students (Summative: {summative_table}, Threshold < {threshold})")
+        ax1.set_xlabel("Student ID")
+        ax1.set_ylabel("Summative Score (%)")
+        ax1.tick_params(axis="x", labelrotation=60)
+        plt.setp(ax1.get_xticklabels(), ha="right")
+
+        ax2.bar(sid, sum_scores, label="Summative (%)")
+        ax2.scatter(sid, for_scores, label="Lowest Formative (%)")
+        ax2.set_title("Summative vs Lowest Formative (Underperforming Students)")
+        ax2.set_xlabel("Student ID")
+        ax2.set_ylabel("Score (%)")
+        ax2.tick_params(axis="x", labelrotation=60)
+        plt.setp(ax2.get_xticklabels(), ha="right")
+        ax2.legend()
+
+        if ax is None:
+            fig.tight_layout()
+            # the Agg backend (scripts / no display) cant show anything, the figure is just returned
+            if show and matplotlib.get_backend().lower() != "agg":
+                plt.show()
+                plt.close(fig)# free the figure once its been drawn
+        return fig